@@ -2,6 +2,10 @@
 API_BASE_URL = "https://www.elprisetjustnu.se/api/v1/prices"
 PRICE_ZONE = "SE3"  # Stockholm price zone
 
+# Cache of API responses, one file per day and zone
+CACHE_DIR = "~/.cache/laddtider"
+CACHE_MAX_AGE_HOURS = 6  # Revalidate with the API (ETag) after this long
+
 # Price components (öre/kWh)
 TIBBER_ADDON = 8.6  # Tibber's fee including VAT
 VAT = 1.25  # 25% VAT
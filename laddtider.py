@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
-import warnings
-warnings.filterwarnings('ignore', message='.*OpenSSL.*')
-
-from datetime import datetime, time, timedelta
+from datetime import datetime, timedelta
+from itertools import chain, groupby
 import logging
 from typing import List, Tuple
-import requests
 import sys
 import config
+from laddtider_core import get_price_data, group_runs, hhmm, parse_prices, price_calculator
 
 # Configure logging
 logging.basicConfig(
@@ -26,100 +24,69 @@ class Config:
     PRICE_ZONE = config.PRICE_ZONE
     TIBBER_ADDON = config.TIBBER_ADDON
     VAT = config.VAT
+    CACHE_DIR = config.CACHE_DIR
+    CACHE_MAX_AGE = timedelta(hours=config.CACHE_MAX_AGE_HOURS)
     
     # Calculate required margin based on grid cost and efficiency
     MARGIN_REQUIRED = config.GRID_COST * (1 - config.SYSTEM_EFFICIENCY)
 
-def get_price_data() -> List[dict]:
-    """Fetch price data from API for tomorrow."""
-    tomorrow = datetime.now().date() + timedelta(days=1)
-    
-    url = f"{Config.API_BASE_URL}/{tomorrow.year}/{tomorrow.strftime('%m-%d')}_{Config.PRICE_ZONE}.json"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch prices for {tomorrow}: {e}")
-        sys.exit(1)
-
-def calculate_total_price(spot_price: float) -> float:
-    """Calculate total price including Tibber fee and VAT."""
-    spot_ore = spot_price * 100
-    price_before_vat = spot_ore + Config.TIBBER_ADDON/Config.VAT
-    return price_before_vat * Config.VAT
+calculate_total_price = price_calculator(Config.TIBBER_ADDON, Config.VAT)
 
 def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], List[datetime]]:
-    """Find optimal hours for charging and discharging."""
-    price_times = []
-    for hour in prices:
-        time_start = datetime.fromisoformat(hour["time_start"].replace('Z', '+00:00')).astimezone()
-        total_price = calculate_total_price(hour["SEK_per_kWh"])
-        price_times.append((time_start, total_price))
-        logger.debug(f"Price for {time_start.strftime('%H:%M')}: {total_price:.1f} öre/kWh")
-    
-    if not price_times:
-        logger.error("No price data available")
-        sys.exit(1)
-    
-    # Sort chronologically
-    price_times.sort(key=lambda x: x[0])
+    """Find optimal hours for charging and discharging.
+
+    Both returned lists are in chronological order.
+    """
+    times, total_prices = parse_prices(prices, calculate_total_price)
+    if logger.isEnabledFor(logging.DEBUG):
+        for time_start, total_price in zip(times, total_prices):
+            logger.debug(f"Price for {hhmm(time_start)}: {total_price:.1f} öre/kWh")
     
     # Find all potential charging blocks (up to 3 consecutive hours each)
     charging_blocks = []
     
+    # continues[k] tells whether hour k+1 directly follows hour k on the same
+    # day, computed once instead of for every block that spans the pair
+    continues = [
+        b - a == timedelta(hours=1) and b.day == a.day
+        for a, b in zip(times, times[1:])
+    ]
+    
     # Look at each hour as a potential start of a charging block
-    for i in range(len(price_times)):
+    for i in range(len(times)):
         # Try to build a block of up to 3 consecutive hours
-        block_times = []
-        block_prices = []
+        end = i + 1
         
-        # Add up to 3 consecutive hours to this block
-        for j in range(3):  # Try to make each block 3 hours if possible
-            if i + j >= len(price_times):
-                break
-                
-            # Stop if we cross midnight
-            if j > 0 and price_times[i+j][0].day != price_times[i][0].day:
-                break
-                
-            # Stop if hours aren't consecutive
-            if j > 0 and price_times[i+j][0] - block_times[-1] != timedelta(hours=1):
-                break
-                
-            block_times.append(price_times[i+j][0])
-            block_prices.append(price_times[i+j][1])
+        # Extend while the next hour is consecutive and doesn't cross midnight
+        while end < min(i + 3, len(times)) and continues[end-1]:
+            end += 1
         
-        if block_times:  # If we found at least one hour
-            avg_price = sum(block_prices) / len(block_prices)
-            
-            # Find discharge opportunities after this block
-            discharge_options = [
-                (t, p) for t, p in price_times[i+len(block_times):]
-                if p >= avg_price + Config.MARGIN_REQUIRED
-            ]
-            
-            if discharge_options:
-                charging_blocks.append({
-                    'times': block_times,
-                    'avg_price': avg_price,
-                    'discharge_options': discharge_options
-                })
-    
-    # Sort blocks by average price and start time
-    charging_blocks.sort(key=lambda x: (x['avg_price'], x['times'][0].hour))
+        block_times = times[i:end]
+        avg_price = sum(total_prices[i:end]) / (end - i)
+        
+        # Find discharge opportunities after this block, as indices
+        discharge_options = [
+            k for k in range(end, len(times))
+            if total_prices[k] >= avg_price + Config.MARGIN_REQUIRED
+        ]
+        
+        if discharge_options:
+            charging_blocks.append({
+                'times': block_times,
+                'avg_price': avg_price,
+                'discharge_options': discharge_options
+            })
     
     all_charge_hours = []
     all_discharge_hours = []
     used_hours = set()
     
-    # Add logging for block selection - sort by time for logging
-    sorted_for_log = sorted(charging_blocks, key=lambda x: x['times'][0])
+    # Add logging for block selection - blocks were built in time order
     logger.info("Found charging blocks (chronological order):")
-    for block in sorted_for_log:
-        times = [t.strftime('%H:%M') for t in block['times']]
+    for block in charging_blocks:
+        labels = [hhmm(t) for t in block['times']]
         logger.info(
-            f"  {'-'.join(times)}, "
+            f"  {'-'.join(labels)}, "
             f"avg price: {block['avg_price']:.1f} öre/kWh, "
             f"discharge options: {len(block['discharge_options'])} hours"
         )
@@ -128,11 +95,13 @@ def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], Lis
     # Keep track of decisions for logging
     decisions = []
     
-    # Keep trying blocks until we've processed all profitable opportunities
-    for block in charging_blocks:
+    # Keep trying blocks, by average price and start time, until we've
+    # processed all profitable opportunities
+    for block in sorted(charging_blocks, key=lambda x: (x['avg_price'], x['times'][0].hour)):
         # Skip if any hours are already used
-        if any(t in used_hours for t in block['times']):
-            logger.debug(f"Skipping block {block['times'][0].strftime('%H:%M')}, hours already used")
+        if not used_hours.isdisjoint(block['times']):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Skipping block {hhmm(block['times'][0])}, hours already used")
             continue
         
         # Add charging hours (each block can be up to 3 hours)
@@ -140,7 +109,8 @@ def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], Lis
         used_hours.update(block['times'])
         
         # Add discharge hours
-        discharge_times = [t for t, _ in block['discharge_options'] if t not in used_hours]
+        discharge_idx = [k for k in block['discharge_options'] if times[k] not in used_hours]
+        discharge_times = [times[k] for k in discharge_idx]
         all_discharge_hours.extend(discharge_times)
         used_hours.update(discharge_times)
         
@@ -148,52 +118,47 @@ def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], Lis
         decision = {
             'charge_times': block['times'],
             'charge_price': block['avg_price'],
-            'discharge_times': discharge_times
+            'discharge_idx': discharge_idx
         }
         decisions.append(decision)
     
     # Log decisions in chronological order
     logger.info("Selected charge/discharge pairs (chronological order):")
     for decision in sorted(decisions, key=lambda x: x['charge_times'][0]):
-        times = [t.strftime('%H:%M') for t in decision['charge_times']]
+        labels = [hhmm(t) for t in decision['charge_times']]
         logger.info(
-            f"Charging: {'-'.join(times)}, "
+            f"Charging: {'-'.join(labels)}, "
             f"avg price: {decision['charge_price']:.1f} öre/kWh"
         )
         
-        if decision['discharge_times']:
-            # Group consecutive discharge hours
-            discharge_groups = []
-            current_group = [decision['discharge_times'][0]]
-            
-            for t in decision['discharge_times'][1:]:
-                if t - current_group[-1] == timedelta(hours=1):
-                    current_group.append(t)
-                else:
-                    discharge_groups.append(current_group)
-                    current_group = [t]
-            discharge_groups.append(current_group)
+        if decision['discharge_idx']:
+            # Group consecutive discharge hours: within a run of consecutive
+            # hours, time minus its position in the run is constant
+            discharge_groups = [
+                [k for _, k in run]
+                for _, run in groupby(
+                    enumerate(decision['discharge_idx']),
+                    key=lambda it: times[it[1]] - timedelta(hours=it[0])
+                )
+            ]
             
             # Log each discharge group
             for group in discharge_groups:
-                start = group[0]
-                end = group[-1] + timedelta(hours=1)
+                start = times[group[0]]
+                end = times[group[-1]] + timedelta(hours=1)
                 # Calculate average price for this discharge period
-                discharge_prices = [p for t, p in price_times if t in group]
-                avg_discharge_price = sum(discharge_prices) / len(discharge_prices)
+                avg_discharge_price = sum(total_prices[k] for k in group) / len(group)
                 logger.info(
-                    f"Discharging: {start.strftime('%H:%M')}-{end.strftime('%H:%M')}, "
+                    f"Discharging: {hhmm(start)}-{hhmm(end)}, "
                     f"avg price: {avg_discharge_price:.1f} öre/kWh"
                 )
         logger.info("")
     
     # Remove any discharge hours that would overlap with charging
-    all_discharge_hours = [
-        t for t in sorted(all_discharge_hours)
-        if t not in all_charge_hours
-    ]
+    all_discharge_hours = sorted(set(all_discharge_hours).difference(all_charge_hours))
     
-    return (sorted(all_charge_hours), sorted(all_discharge_hours))
+    # Blocks are picked cheapest first, so only the charge hours need sorting
+    return (sorted(all_charge_hours), all_discharge_hours)
 
 def main() -> None:
     """Main function."""
@@ -204,26 +169,17 @@ def main() -> None:
         logger.info(f"\n=== Starting price analysis at {now.strftime('%Y-%m-%d %H:%M:%S')} ===")
         logger.info(f"Analyzing prices for: {tomorrow.strftime('%Y-%m-%d')}\n")
         
-        prices = get_price_data()
+        prices = get_price_data(Config)
         charge_hours, discharge_hours = find_charge_discharge_hours(prices)
         
         # Combine all events and sort chronologically
-        all_events = [(t, '+') for t in charge_hours] + [(t, '-') for t in discharge_hours]
-        all_events.sort(key=lambda x: x[0])  # Sort by time
+        all_events = sorted(
+            chain(((t, '+') for t in charge_hours), ((t, '-') for t in discharge_hours)),
+            key=lambda x: x[0]  # Sort by time
+        )
         
         # Group consecutive hours with same action
-        groups = []
-        if all_events:
-            current_group = [all_events[0]]
-            
-            for event in all_events[1:]:
-                if (event[0] - current_group[-1][0] == timedelta(hours=1) and 
-                    event[1] == current_group[-1][1]):
-                    current_group.append(event)
-                else:
-                    groups.append(current_group)
-                    current_group = [event]
-            groups.append(current_group)
+        groups = group_runs(all_events)
         
         # Log summary of decisions
         logger.info("\nFinal schedule:")
@@ -231,8 +187,8 @@ def main() -> None:
             start = block[0][0]
             end = block[-1][0] + timedelta(hours=1)
             action = "Charging" if block[0][1] == '+' else "Discharging"
-            end_str = "23:59" if (block[-1][0].hour == 23 or end.hour == 0) else end.strftime('%H:%M')
-            logger.info(f"{action}: {start.strftime('%H:%M')}-{end_str}")
+            end_str = "23:59" if (block[-1][0].hour == 23 or end.hour == 0) else hhmm(end)
+            logger.info(f"{action}: {hhmm(start)}-{end_str}")
         
         # Log end of run
         logger.info(f"\n=== Completed price analysis at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
@@ -243,8 +199,8 @@ def main() -> None:
             end = group[-1][0] + timedelta(hours=1)
             action = group[0][1]
             is_last_hour = group[-1][0].hour == 23 or end.hour == 0
-            end_str = "23:59" if is_last_hour else end.strftime('%H:%M')
-            print(f"{start.strftime('%H:%M')}-{end_str}/1234567/{action}")
+            end_str = "23:59" if is_last_hour else hhmm(end)
+            print(f"{hhmm(start)}-{end_str}/1234567/{action}")
         
     except Exception as e:
         logger.error(f"\n!!! Error occurred at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {e}")
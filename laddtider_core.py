@@ -0,0 +1,168 @@
+"""Code shared by laddtider.py and laddtider_simple.py.
+
+Each script keeps its own Config and scheduling strategy; fetching,
+caching, price calculation, parsing and schedule grouping live here.
+A Config is any class with API_BASE_URL, PRICE_ZONE, CACHE_DIR and
+CACHE_MAX_AGE attributes.
+"""
+from datetime import date, datetime, timedelta
+from itertools import groupby
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import tempfile
+from typing import Callable, List, Optional, Tuple
+import warnings
+
+# urllib3 warns once, at import time, when ssl isn't backed by OpenSSL (e.g.
+# macOS LibreSSL); silence that warning for this import only instead of
+# leaving the filter installed for the whole run
+with warnings.catch_warnings():
+    warnings.filterwarnings('ignore', message='.*OpenSSL.*')
+    import requests
+    from requests.adapters import HTTPAdapter
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional, fall back to the stdlib decoder
+    from json import loads as json_loads
+
+logger = logging.getLogger(__name__)
+
+# Shared HTTP session so repeated requests reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+def _read_cache(cache_path: Path) -> dict:
+    """Return the cached response for a day, or an empty dict if there is none."""
+    try:
+        return json_loads(cache_path.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+def _write_cache(cache_path: Path, entry: dict) -> None:
+    """Atomically write a cached response so a crash never leaves a partial file."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, cache_path)
+        finally:
+            # Only left behind if the write or replace failed
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    except OSError as e:
+        logger.warning(f"Failed to write price cache {cache_path}: {e}")
+
+def get_price_data(config, day: Optional[date] = None) -> List[dict]:
+    """Fetch price data from API for a day, tomorrow by default.
+
+    Responses are cached on disk per day and zone. A cached day younger than
+    CACHE_MAX_AGE is returned without touching the network; an older one is
+    revalidated with If-None-Match/If-Modified-Since so a 304 skips the body.
+    A published day never changes, so if revalidation fails the cached copy
+    is used; only a day with no cache exits on a failed fetch.
+    """
+    day = day or datetime.now().date() + timedelta(days=1)
+    cache_path = Path(config.CACHE_DIR).expanduser() / f"{day.isoformat()}_{config.PRICE_ZONE}.json"
+    cached = _read_cache(cache_path)
+    
+    if cached:
+        age = datetime.now().timestamp() - cache_path.stat().st_mtime
+        if age < config.CACHE_MAX_AGE.total_seconds():
+            return cached['prices']
+    
+    headers = {}
+    if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    
+    url = f"{config.API_BASE_URL}/{day.year}/{day.strftime('%m-%d')}_{config.PRICE_ZONE}.json"
+    try:
+        response = _session.get(url, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            cache_path.touch()
+            return cached['prices']
+        response.raise_for_status()
+        prices = json_loads(response.content)
+    except (requests.RequestException, ValueError) as e:
+        if cached:
+            logger.warning(f"Failed to revalidate prices for {day}, using cached copy: {e}")
+            return cached['prices']
+        logger.error(f"Failed to fetch prices for {day}: {e}")
+        sys.exit(1)
+    
+    _write_cache(cache_path, {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'prices': prices
+    })
+    return prices
+
+def price_calculator(tibber_addon: float, vat: float) -> Callable[[float], float]:
+    """Return a function calculating total price including Tibber fee and VAT.
+
+    Tibber's fee excluding VAT is computed once here rather than per hour.
+    """
+    addon_before_vat = tibber_addon / vat
+    
+    def calculate_total_price(spot_price: float) -> float:
+        """Calculate total price including Tibber fee and VAT."""
+        return (spot_price * 100 + addon_before_vat) * vat
+    
+    return calculate_total_price
+
+# HH:MM labels for whole hours, so formatting hour-aligned times is a lookup
+_HHMM = [f"{h:02d}:00" for h in range(24)]
+
+def hhmm(t: datetime) -> str:
+    """Format a time as HH:MM, using the lookup table for whole hours."""
+    return _HHMM[t.hour] if t.minute == 0 else t.strftime('%H:%M')
+
+def _parse_time(timestamp: str) -> datetime:
+    """Parse an API timestamp into local time.
+
+    The conversion is left to astimezone() per record rather than a tz
+    captured once: a fixed offset would be wrong on DST-change days.
+    """
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    return datetime.fromisoformat(timestamp).astimezone()
+
+def parse_prices(prices: List[dict],
+                 calculate_total_price: Callable[[float], float]) -> Tuple[List[datetime], List[float]]:
+    """Parse API rows into chronologically sorted hour times and total prices.
+
+    Hours are kept as two parallel lists, indexed by position, rather than
+    as (time, price) tuples.
+    """
+    times = [_parse_time(hour["time_start"]) for hour in prices]
+    total_prices = [calculate_total_price(hour["SEK_per_kWh"]) for hour in prices]
+    
+    if not times:
+        logger.error("No price data available")
+        sys.exit(1)
+    
+    # Sort chronologically
+    order = sorted(range(len(times)), key=times.__getitem__)
+    return [times[k] for k in order], [total_prices[k] for k in order]
+
+def group_runs(events: List[Tuple[datetime, str]]) -> List[List[Tuple[datetime, str]]]:
+    """Group chronologically sorted (time, action) events into runs of
+    consecutive hours with the same action.
+
+    Within such a run, time minus the event's index is constant, so a
+    single groupby on (action, time - index) yields the runs directly.
+    """
+    return [
+        [event for _, event in run]
+        for _, run in groupby(
+            enumerate(events),
+            key=lambda ie: (ie[1][1], ie[1][0] - timedelta(hours=ie[0]))
+        )
+    ]
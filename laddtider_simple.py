@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
-import warnings
-warnings.filterwarnings('ignore', message='.*OpenSSL.*')
-
-from datetime import datetime, time, timedelta
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import chain
 import logging
 from typing import List, Tuple
-import requests
 import sys
+from laddtider_core import get_price_data, group_runs, hhmm, parse_prices, price_calculator
 
 # Configure logging
 logging.basicConfig(
@@ -27,47 +26,29 @@ class Config:
     
     # Price margin required for profitable discharge (includes battery efficiency losses)
     MARGIN_REQUIRED = 25  # öre/kWh (0.25 SEK/kWh)
-
-def get_price_data() -> List[dict]:
-    """Fetch price data from API for tomorrow."""
-    tomorrow = datetime.now().date() + timedelta(days=1)
     
-    url = f"{Config.API_BASE_URL}/{tomorrow.year}/{tomorrow.strftime('%m-%d')}_{Config.PRICE_ZONE}.json"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        logger.error(f"Failed to fetch prices for {tomorrow}: {e}")
-        sys.exit(1)
+    # On-disk cache of API responses, revalidated once older than this
+    CACHE_DIR = "~/.cache/laddtider"
+    CACHE_MAX_AGE = timedelta(hours=6)
 
-def calculate_total_price(spot_price: float) -> float:
-    """Calculate total price including Tibber fee and VAT."""
-    spot_ore = spot_price * 100
-    price_before_vat = spot_ore + Config.TIBBER_PÅSLAG/Config.MOMS
-    return price_before_vat * Config.MOMS
+calculate_total_price = price_calculator(Config.TIBBER_PÅSLAG, Config.MOMS)
 
 def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], List[datetime]]:
-    """Find optimal hours for charging and discharging."""
-    price_times = []
-    for hour in prices:
-        time_start = datetime.fromisoformat(hour["time_start"].replace('Z', '+00:00')).astimezone()
-        total_price = calculate_total_price(hour["SEK_per_kWh"])
-        price_times.append((time_start, total_price))
-    
-    if not price_times:
-        logger.error("No price data available")
-        sys.exit(1)
-    
-    # Sort chronologically
-    price_times.sort(key=lambda x: x[0])
+    """Find optimal hours for charging and discharging.
+
+    Both returned lists are in chronological order. Charge hours need no
+    final sort: blocks come from disjoint day segments and are processed
+    by start time, each appending its hours in order.
+    """
+    times, total_prices = parse_prices(prices, calculate_total_price)
     
-    # Split day into potential charging periods (avoiding midnight crossing)
+    # Split day into potential charging periods (avoiding midnight crossing),
+    # each segment a list of indices
     day_segments = [
         # Night/early morning: 00:00-05:00
-        [(t, p) for t, p in price_times if 0 <= t.hour < 5],
+        [k for k, t in enumerate(times) if 0 <= t.hour < 5],
         # Morning/afternoon: 12:00-16:00
-        [(t, p) for t, p in price_times if 12 <= t.hour < 16],
+        [k for k, t in enumerate(times) if 12 <= t.hour < 16],
     ]
     
     charge_blocks = []  # Store (block, avg_price) tuples
@@ -78,21 +59,16 @@ def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], Lis
         if len(segment) < 3:  # Need at least 3 hours for charging
             continue
             
-        # Find cheapest 3 consecutive hours in this segment
-        cheapest_block = None
-        cheapest_price = float('inf')
-        
-        for i in range(len(segment) - 2):
-            block_times = [segment[i+j][0] for j in range(3)]
-            block_prices = [segment[i+j][1] for j in range(3)]
-            avg_price = sum(block_prices) / 3
-            
-            if avg_price < cheapest_price:
-                cheapest_price = avg_price
-                cheapest_block = block_times
-        
-        if cheapest_block:
-            charge_blocks.append((cheapest_block, cheapest_price))
+        # Find cheapest 3 consecutive hours in this segment, averaging every
+        # 3-hour window in one pass over the shifted price lists
+        segment_prices = [total_prices[k] for k in segment]
+        window_avgs = [
+            (a + b + c) / 3
+            for a, b, c in zip(segment_prices, segment_prices[1:], segment_prices[2:])
+        ]
+        i = min(range(len(window_avgs)), key=window_avgs.__getitem__)
+        cheapest_block = [times[k] for k in segment[i:i+3]]
+        charge_blocks.append((cheapest_block, window_avgs[i]))
     
     # Sort charge blocks by time
     charge_blocks.sort(key=lambda x: x[0][0])  # Sort by start time of block
@@ -107,10 +83,12 @@ def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], Lis
         charge_end_time = block[-1]
         min_discharge_price = avg_price + Config.MARGIN_REQUIRED
         
-        # Add discharge candidates to set
+        # Add discharge candidates to set; times are sorted, so the hours
+        # after the block start at a bisected index
+        start = bisect_right(times, charge_end_time)
         discharge_candidates.update(
-            t for t, p in price_times 
-            if t > charge_end_time and p >= min_discharge_price
+            times[k] for k in range(start, len(times))
+            if total_prices[k] >= min_discharge_price
         )
     
     return (all_charge_hours, sorted(discharge_candidates))
@@ -118,33 +96,24 @@ def find_charge_discharge_hours(prices: List[dict]) -> Tuple[List[datetime], Lis
 def main() -> None:
     """Main function."""
     try:
-        prices = get_price_data()
+        prices = get_price_data(Config)
         charge_hours, discharge_hours = find_charge_discharge_hours(prices)
         
         # Combine all events and sort chronologically
-        all_events = [(t, '+') for t in charge_hours] + [(t, '-') for t in discharge_hours]
-        all_events.sort(key=lambda x: x[0])  # Sort by time
+        all_events = sorted(
+            chain(((t, '+') for t in charge_hours), ((t, '-') for t in discharge_hours)),
+            key=lambda x: x[0]  # Sort by time
+        )
         
         # Group consecutive hours with same action
-        groups = []
-        if all_events:
-            current_group = [all_events[0]]
-            
-            for event in all_events[1:]:
-                if (event[0] - current_group[-1][0] == timedelta(hours=1) and 
-                    event[1] == current_group[-1][1]):
-                    current_group.append(event)
-                else:
-                    groups.append(current_group)
-                    current_group = [event]
-            groups.append(current_group)
+        groups = group_runs(all_events)
         
         # Print each group (time range only)
         for group in groups:
             start = group[0][0]
             end = group[-1][0] + timedelta(hours=1)
             action = group[0][1]
-            print(f"{start.strftime('%H:%M')}-{end.strftime('%H:%M')}/1234567/{action}")
+            print(f"{hhmm(start)}-{hhmm(end)}/1234567/{action}")
         
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")